@@ -6,17 +6,47 @@
 # - 🎲 只挑 messages 為空的資料
 # - 所有按鈕 width='stretch'
 # - 存檔：回寫頂層 model / contributor（messages 只保留 role/content）
+# - 有 id 的資料新增對話時只追加一行帶 _patch（目標位置）的變更欄位，讀取時只合併這種行
+# - 設定 DATA_DB 時改存 SQLite（一筆一列），data.jsonl 作為匯入/匯出
 
 import os
 import json
+import math
+import asyncio
 import base64
 import random
 import re
-from typing import List, Dict, Any, Optional
+import sys
+import hashlib
+import mmap
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time as _time
+from io import BytesIO
+from typing import List, Dict, Any, Optional, Awaitable, Callable, Tuple
 from collections import Counter  # 統計 contributor
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 
 import streamlit as st
 from filelock import FileLock
+from PIL import Image, ImageOps
+try:
+    import orjson  # C 實作的 JSON，讀寫 JSONL 較快
+except Exception:
+    orjson = None
+try:
+    import httpx
+    from openai import AsyncOpenAI
+except Exception:
+    AsyncOpenAI = None  # 未安裝 openai 時，所有生成走備援
+try:
+    import fcntl  # POSIX 直接 flock；Windows 沒有這個模組，改用 FileLock
+except ImportError:
+    fcntl = None
 
 st.set_page_config(
     page_title="Twinkle Gallery", 
@@ -37,13 +67,14 @@ try:
 except Exception:
     from pytz import timezone as ZoneInfo  # fallback,若環境只有 pytz
 
+try:
+    _TAIPEI_TZ = ZoneInfo("Asia/Taipei")
+except Exception:
+    # 萬一系統沒安裝時區資料，就用系統時間
+    _TAIPEI_TZ = None
+
 def _now_in_taipei():
-    try:
-        tz = ZoneInfo("Asia/Taipei") if isinstance(ZoneInfo, type) else ZoneInfo("Asia/Taipei")
-        return datetime.now(tz)
-    except Exception:
-        # 萬一系統沒安裝時區資料，就用系統時間
-        return datetime.now()
+    return datetime.now(_TAIPEI_TZ)
 
 def _is_dark_by_taipei_time(now_dt: Optional[datetime] = None) -> bool:
     """
@@ -65,6 +96,11 @@ def _pick_image_by_time(light_path: str, dark_path: str) -> str:
         chosen = light_path
     return chosen
 
+@st.cache_data(ttl=300, show_spinner=False)
+def _pick_image_by_time_cached(light_path: str, dark_path: str) -> str:
+    # 日夜切換最多晚 5 分鐘生效，換來每次 rerun 免算時間、免查檔案
+    return _pick_image_by_time(light_path, dark_path)
+
 # ------------------------
 # Secrets & App logo
 # ------------------------
@@ -77,15 +113,24 @@ def _get_secret(key: str, default=None):
     return os.getenv(key, default)
 
 DATA_JSONL = _get_secret("DATA", "data.jsonl")  # 可放檔名或絕對路徑
+DATA_DB = _get_secret("DATA_DB", None)  # 設定後改存 SQLite；DATA 只作為匯入/匯出
 API_BASE = _get_secret("MY_API_BASE", None)
 API_KEY  = _get_secret("OPENAI_API_KEY", None)
 MODEL    = _get_secret("MY_MODEL_NAME", "gpt-4o-mini")
+Q_MAX_TOKENS = 80   # 問題只要一句話
+A_MAX_TOKENS = 600  # 答案上限，避免伺服器異常時無限生成
 SUPPORTS_VISION = str(_get_secret("SUPPORTS_VISION", "true")).lower() in ("1", "true", "yes")
+SEND_ORIGINAL_IMAGE = str(_get_secret("SEND_ORIGINAL_IMAGE", "false")).lower() in ("1", "true", "yes")
+MODEL_IMAGE_MAX_SIDE = 1024  # 送給模型前把長邊縮到這個像素（視覺模型內部也會縮）
+CACHE_DIR = _get_secret("CACHE_DIR", os.path.join(tempfile.gettempdir(), "gallery_cache"))  # 模型回應快取
+RESP_CACHE_TTL = int(_get_secret("RESP_CACHE_TTL", 86400))  # 秒；0 表示關閉回應快取
+RESP_CACHE_MAX_ENTRIES = int(_get_secret("RESP_CACHE_MAX_ENTRIES", 1024))  # 超過就由舊到新刪
+IMAGE_CACHE_MAX_BYTES = int(_get_secret("IMAGE_CACHE_MAX_BYTES", 256 << 20))  # 圖片 data URL 快取總大小上限
 APP_LOGO_LIGHT = _get_secret("APP_LOGO_LIGHT", "static/logo_light.png")  # 可放檔名或 URL
 APP_LOGO_DARK  = _get_secret("APP_LOGO_DARK", "static/logo_dark.png")    # 可放檔名或 URL
 
 # 嘗試顯示 logo（若失敗就忽略）
-APP_LOGO = _pick_image_by_time(APP_LOGO_LIGHT, APP_LOGO_DARK)
+APP_LOGO = _pick_image_by_time_cached(APP_LOGO_LIGHT, APP_LOGO_DARK)
 try:
     st.logo(APP_LOGO)
 except Exception:
@@ -96,90 +141,320 @@ except Exception:
 # ------------------------
 
 def _get_client():
-    if not API_KEY or not API_BASE:
+    # AsyncOpenAI 的連線池綁在建立它的 event loop 上，asyncio.run 每次都是新 loop，
+    # 所以每輪生成建一個、由該輪的 Q / A 共用（keep-alive，同一條連線免重做 TLS），用完即關
+    if AsyncOpenAI is None or not API_KEY or not API_BASE:
         return None
     try:
-        from openai import OpenAI
-        return OpenAI(api_key=API_KEY, base_url=API_BASE)
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
+            timeout=httpx.Timeout(connect=5.0, read=60.0, write=60.0, pool=5.0),
+        )
+        return AsyncOpenAI(api_key=API_KEY, base_url=API_BASE, http_client=http_client, max_retries=3)
     except Exception:
         return None
 
+def _cache_put(path: str, data: bytes):
+    """原子寫入 CACHE_DIR 下的快取檔；寫不進去不影響主流程。"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError:
+        _unlink_quiet(tmp)  # 例如磁碟滿：別留下寫一半的暫存檔
+
+def _has_alpha(im: Image.Image) -> bool:
+    return im.mode in ("RGBA", "LA") or (im.mode == "P" and "transparency" in im.info)
+
+_CACHE_KEY_RE = re.compile(r"[0-9a-f]{64}")  # 快取檔名是 sha256；CACHE_DIR 可自訂，別動到其他檔案
+
+def _prune_cache(suffix: str, max_entries: int, ttl: Optional[float] = None, max_bytes: Optional[int] = None):
+    """刪掉 CACHE_DIR 下過期的 <sha256><suffix> 快取檔，再由舊到新刪到不超過筆數 / 總大小上限。"""
+    now = _time.time()
+    entries = []
+    try:
+        with os.scandir(CACHE_DIR) as it:
+            for e in it:
+                if not (e.name.endswith(suffix) and _CACHE_KEY_RE.fullmatch(e.name[:-len(suffix)])):
+                    continue
+                try:
+                    st_ = e.stat()
+                except OSError:
+                    continue
+                if ttl is not None and now - st_.st_mtime > ttl:
+                    _unlink_quiet(e.path)
+                    continue
+                entries.append((st_.st_mtime, st_.st_size, e.path))
+    except OSError:
+        return
+    entries.sort(reverse=True)  # 新的在前
+    total = 0
+    for n, (_, size, path) in enumerate(entries):
+        total += size
+        if n >= max_entries or (max_bytes is not None and total > max_bytes):
+            _unlink_quiet(path)
+
+def _unlink_quiet(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+_MIME_BY_EXT = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".webp": "image/webp"}
+
+def _downscaled_data_url(img_path: str, max_side: int) -> Optional[str]:
+    """長邊超過 max_side 才縮圖重新編碼（有透明度用 PNG，其餘 JPEG q85）；不需要縮則回傳 None。"""
+    with Image.open(img_path) as im:
+        if max(im.size) <= max_side:
+            return None
+        has_alpha = _has_alpha(im)
+        # 重新編碼會丟掉 EXIF，先轉正，模型才不會看到橫躺的照片
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail((max_side, max_side), Image.LANCZOS)
+        buf = BytesIO()
+        if has_alpha:
+            im.save(buf, "PNG")
+            mime = "image/png"
+        else:
+            im.convert("RGB").save(buf, "JPEG", quality=85)
+            mime = "image/jpeg"
+    return f"data:{mime};base64,{base64.b64encode(buf.getbuffer()).decode('ascii')}"
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def _data_url_cached(img_path: str, mtime: float, size: int) -> Optional[str]:
+    # mtime / size 只作為快取鍵：圖片被替換後自動失效
+    # 記憶體快取之外再落地一份到 CACHE_DIR，重啟或被擠出記憶體後不必重新編碼
+    variant = "orig" if SEND_ORIGINAL_IMAGE else f"max{MODEL_IMAGE_MAX_SIDE}"
+    key = hashlib.sha256(f"{os.path.abspath(img_path)}|{mtime}|{size}|{variant}".encode("utf-8")).hexdigest()
+    disk_path = os.path.join(CACHE_DIR, key + ".dataurl")
+    try:
+        with open(disk_path, "rb") as f:
+            return f.read().decode("ascii")
+    except OSError:
+        pass
+
+    url = None
+    if not SEND_ORIGINAL_IMAGE:
+        try:
+            url = _downscaled_data_url(img_path, MODEL_IMAGE_MAX_SIDE)
+        except Exception:
+            url = None  # PIL 讀不了就送原檔
+    if url is None:
+        with open(img_path, "rb") as f:
+            if size:
+                # 直接對 mmap 編碼，省掉 f.read() 那份整張圖的 bytes 副本
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    b64 = base64.b64encode(mm).decode("ascii")
+            else:
+                b64 = ""
+        ext = os.path.splitext(img_path)[1].lower()
+        mime = _MIME_BY_EXT.get(ext, "image/jpeg")
+        url = f"data:{mime};base64,{b64}"
+    _cache_put(disk_path, url.encode("ascii"))
+    # 圖片快取檔動輒數 MB：與回應快取同樣的過期 / 筆數上限，另外限制總大小
+    _prune_cache(".dataurl", RESP_CACHE_MAX_ENTRIES, ttl=RESP_CACHE_TTL or None, max_bytes=IMAGE_CACHE_MAX_BYTES)
+    return url
+
 def _data_url(img_path: str) -> Optional[str]:
-    if not img_path or not os.path.exists(img_path):
+    if not img_path:
         return None
-    with open(img_path, "rb") as f:
-        b64 = base64.b64encode(f.read()).decode()
-    ext = os.path.splitext(img_path)[1].lower()
-    mime = {".jpg":"image/jpeg",".jpeg":"image/jpeg",".png":"image/png",".webp":"image/webp"}.get(ext,"image/jpeg")
-    return f"data:{mime};base64,{b64}"
+    try:
+        stat = os.stat(img_path)
+    except OSError:
+        return None
+    return _data_url_cached(img_path, stat.st_mtime, stat.st_size)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _thumbnail(img_path: str, mtime: float, max_w: int = 1280) -> bytes:
+    """縮成適合畫面的 bytes（有透明度用 PNG，其餘 JPEG）；原圖已夠小就直接回傳原檔。mtime 只作為快取鍵。"""
+    with Image.open(img_path) as im:
+        if max(im.size) <= max_w:
+            with open(img_path, "rb") as f:
+                return f.read()
+        # 重新編碼會丟掉 EXIF，先依 Orientation 轉正，手機直拍的照片才不會橫躺
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail((max_w, max_w))
+        buf = BytesIO()
+        if _has_alpha(im):
+            im.save(buf, "PNG")
+        else:
+            im.convert("RGB").save(buf, "JPEG", quality=82)
+    return buf.getvalue()
 
+async def _data_url_async(img_path: str) -> Optional[str]:
+    # base64 編碼丟到 thread，不卡住 event loop 上的 API 呼叫
+    try:
+        return await asyncio.to_thread(_data_url, img_path)
+    except Exception:
+        return None
+
+def _resp_cache_path(messages: List[Dict[str, Any]], temperature: float, max_tokens: Optional[int]) -> str:
+    # 以 (model, messages 含圖片 data URL, temperature, max_tokens) 的 sha256 作為內容位址；seed 不納入
+    h = hashlib.sha256()
+    h.update(MODEL.encode("utf-8"))
+    h.update(json.dumps(messages, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    h.update(repr(float(temperature)).encode("ascii"))
+    h.update(repr(max_tokens).encode("ascii"))
+    return os.path.join(CACHE_DIR, h.hexdigest() + ".txt")
+
+def _resp_cache_get(path: str) -> Optional[str]:
+    try:
+        if _time.time() - os.path.getmtime(path) > RESP_CACHE_TTL:
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+_STREAM_PUSH_INTERVAL = 0.05  # 秒
+
+async def _cached_chat(
+    client,
+    messages: List[Dict[str, Any]],
+    temperature: float,
+    seed: int,
+    max_tokens: Optional[int] = None,
+    use_cache: bool = True,
+    on_delta: Optional[Callable[[str], None]] = None,
+) -> str:
+    """
+    chat.completions 外包一層磁碟快取：輸入完全相同的重試/重產直接讀本機結果。
+    有 on_delta 時改用 stream=True，每收到一段就以「目前累積的全文」回呼，供 UI 即時顯示。
+    """
+    path = _resp_cache_path(messages, temperature, max_tokens) if use_cache and RESP_CACHE_TTL > 0 else None
+    if path:
+        hit = _resp_cache_get(path)
+        if hit is not None:
+            if on_delta:
+                on_delta(hit)
+            return hit
+    if on_delta:
+        stream = await client.chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            temperature=temperature,
+            seed=seed,
+            max_tokens=max_tokens,
+            stream=True,
+        )
+        parts: List[str] = []
+        last_push = 0.0
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                # 逐 token 推 UI 會塞爆 websocket，合併成最多每 50ms 更新一次
+                now = _time.monotonic()
+                if now - last_push >= _STREAM_PUSH_INTERVAL:
+                    on_delta("".join(parts))
+                    last_push = now
+        out = "".join(parts)
+        on_delta(out)
+    else:
+        resp = await client.chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            temperature=temperature,
+            seed=seed,
+            max_tokens=max_tokens,
+        )
+        out = resp.choices[0].message.content or ""
+    if path and out.strip():
+        _cache_put(path, out.encode("utf-8"))
+        _prune_cache(".txt", RESP_CACHE_MAX_ENTRIES, ttl=RESP_CACHE_TTL)
+    return out
+
+# 1) 直接移除常見前綴（避免破壞句意）
+_PATTERNS_REMOVE = [
+    r"(?i)\s*作為一個?AI[^\n。]*[。]?",
+    r"\s*根據(本張)?圖片[^\n。]*[。]?",
+    r"\s*從(這張)?圖片(中)?(可以|能)?看(到|出)[^\n。]*[。]?",
+    r"\s*根據(提供的)?文字(內容)?[^\n。]*[。]?",
+    r"\s*依(據|照)提示[^\n。]*[。]?",
+    r"\s*綜合(以上|上述)(資訊|內容)[^\n。]*[。]?",
+    r"\s*就(我|我們)所(知|見)[^\n。]*[。]?",
+    r"\s*基於(題示|提供)[^\n。]*[。]?",
+]
+# 2) 溫和重寫一些短語
+_REPLACEMENTS = {
+    "總結來說，": "",
+    "總而言之，": "",
+    "整體來看，": "",
+    "整體而言，": "",
+    "一般而言，": "一般來說，",
+    "通常而言，": "通常來說，",
+    "我推測": "看起來",
+    "我認為": "看來",
+    "我猜測": "或許",
+    "可以看出": "看來",
+    "可以推斷": "多半",
+    "看起來像是": "看起來是",
+}
+
+# import 時編譯一次；規則仍逐條依序套用，前一條的結果可能讓後一條命中（例如 我推測像是 → 看起來是）
+_REMOVE_RES = [re.compile(p) for p in _PATTERNS_REMOVE]
+_WS_MULTINL_RE = re.compile(r"\n{3,}")
+_TRAIL_WS_RE = re.compile(r"[ \t]+(\n)")
+
+# 預篩：每條規則都必須含有其中某個子字串才可能命中；全都沒有就不必跑 regex
+_SANITIZE_TRIGGERS = (
+    ("作為", "根據", "圖片", "提示", "綜合", "就我", "基於")  # _PATTERNS_REMOVE
+    + tuple(_REPLACEMENTS)                                 # 短語替換
+    + ("\n\n\n", " \n", "\t\n")                            # 空白清理
+)
+
+@lru_cache(maxsize=512)  # 純函式；同一段輸出在重跑時不必再掃一次
 def sanitize_model_output(s: str) -> str:
     """移除/重寫可能洩漏來源或提示字眼的語句，保持自然語氣。"""
     if not s:
         return s
+    if not any(t in s for t in _SANITIZE_TRIGGERS):
+        return s.strip()
 
-    # 1) 直接移除常見前綴（避免破壞句意）
-    patterns_remove = [
-        r"(?i)\s*作為一個?AI[^\n。]*[。]?",
-        r"\s*根據(本張)?圖片[^\n。]*[。]?",
-        r"\s*從(這張)?圖片(中)?(可以|能)?看(到|出)[^\n。]*[。]?",
-        r"\s*根據(提供的)?文字(內容)?[^\n。]*[。]?",
-        r"\s*依(據|照)提示[^\n。]*[。]?",
-        r"\s*綜合(以上|上述)(資訊|內容)[^\n。]*[。]?",
-        r"\s*就(我|我們)所(知|見)[^\n。]*[。]?",
-        r"\s*基於(題示|提供)[^\n。]*[。]?",
-    ]
-    for pat in patterns_remove:
-        s = re.sub(pat, "", s)
-
-    # 2) 溫和重寫一些短語
-    replacements = {
-        "總結來說，": "",
-        "總而言之，": "",
-        "整體來看，": "",
-        "整體而言，": "",
-        "一般而言，": "一般來說，",
-        "通常而言，": "通常來說，",
-        "我推測": "看起來",
-        "我認為": "看來",
-        "我猜測": "或許",
-        "可以看出": "看來",
-        "可以推斷": "多半",
-        "看起來像是": "看起來是",
-    }
-    for k, v in replacements.items():
+    for pat in _REMOVE_RES:
+        s = pat.sub("", s)
+    for k, v in _REPLACEMENTS.items():
         s = s.replace(k, v)
 
     # 3) 清理空白
-    s = re.sub(r"\n{3,}", "\n\n", s)
-    s = re.sub(r"[ \t]+(\n)", r"\1", s)
+    s = _WS_MULTINL_RE.sub("\n\n", s)
+    s = _TRAIL_WS_RE.sub(r"\1", s)
     s = s.strip()
     return s
 
 # ------------------------
 # Auth（從 secrets 讀使用者）
 # ------------------------
+@st.cache_data(show_spinner=False)
 def load_users_from_secrets() -> List[Dict[str, Any]]:
+    # secrets 在 process 生命週期內不變，正規化一次即可
     try:
         users = st.secrets.get("users", [])
         if isinstance(users, dict):
             users = [users[k] for k in sorted(users.keys())]
-        return list(users)
+        return [dict(u) for u in users]
     except Exception:
         return []
 
-def _bcrypt_available():
-    try:
-        import bcrypt  # type: ignore
-        return True
-    except Exception:
-        return False
+@st.cache_resource(show_spinner=False)
+def users_by_name() -> Dict[str, Dict[str, Any]]:
+    """username → 使用者設定；重複帳號以第一筆為準（與原本線性搜尋一致）。唯讀，勿修改。"""
+    by_name: Dict[str, Dict[str, Any]] = {}
+    for u in load_users_from_secrets():
+        if u.get("username") is not None:
+            by_name.setdefault(u["username"], u)
+    return by_name
 
-BC_AVAILABLE = _bcrypt_available()
+try:
+    import bcrypt  # type: ignore
+    BC_AVAILABLE = True
+except Exception:
+    BC_AVAILABLE = False
 
 def verify_password(user_record: Dict[str, Any], password: str) -> bool:
     if BC_AVAILABLE and user_record.get("password_hash"):
-        import bcrypt  # type: ignore
         try:
             return bcrypt.checkpw(password.encode(), user_record["password_hash"].encode())
         except Exception:
@@ -191,114 +466,118 @@ def verify_password(user_record: Dict[str, Any], password: str) -> bool:
 # ------------------------
 # QA 產生：Q（看圖）/ A（只看 text）
 # ------------------------
-def gen_question_from_image(img_path: str, fallback_text: str, temperature: float) -> Optional[str]:
-    # 問題生成的模式與隨機種子（供 UI 顯示）
-    mode = "visual"  # 或 "intro"
-    q_seed = random.randint(1, 10_000)
+
+# 固定的 system prompt 放在模組層級、不做任何插值：
+# 每次請求的前綴逐 byte 相同，供應端的 prompt prefix cache 才會命中
+_SYS_INTRO_Q = (
+    "你是一位提示語句產生器，目標是產生一個能引導對方『介紹這張圖片或談談由來/故事』的單句問句。"
+    "限制：使用繁體中文、自然口語、不可包含引號或前後綴字樣、不要超過30字。"
+    "重點：問題必須通用、開放式，不能包含任何具體地名、數字、人名或推測，不得引用圖片或文字中的內容。"
+)
+_USER_INTRO_Q = (
+    "請只輸出一句自然的繁中問句，引導對方介紹或說說這張圖的背景故事。"
+    "務必避免加入任何特定名詞或細節，讓問句具有普適性。"
+)
+_INTRO_QUESTION = "可以簡單介紹一下這張圖片嗎？"  # 盲問的備援問句，也是並行作答時 A 所針對的問題
+_SYS_VISUAL_Q = "你是精準的視覺助理。請根據圖片提出『一個』具體可答的問題，避免主觀揣測。以繁體中文。"
+_SYS_ANSWER = (
+    "你是一位自然親切、知識穩健的助理。"
+    "請以自然語氣作答，像在與使用者對話，不使用任何標題或固定格式。"
+    "回答時不得提及或暗示資訊來源（例如『從圖片可見』『根據文字內容』『依照提示』等），"
+    "也不要提到系統、規則、模型或任何技術性詞彙。"
+    "先清楚回答問題；若有助理解且允許補充，可自然加入背景脈絡，使用不確定語氣（如『可能、一般來說、或許』），"
+    "避免對特定人事時地物做未經證實的斷言。"
+    "當你要引入新的地名、人物或主題，而這些資訊並未在問題或文字中明確出現時，"
+    "請務必在前面加上自然的承接句，使敘事流暢。"
+    "最後可用一句自然的話詢問對方是否想更深入了解。"
+)
+
+def _update_qa_meta(**kw):
+    # Q / A 可能並行，各自只更新自己的欄位，不互相覆蓋
+    meta = dict(st.session_state.get("qa_meta", {}))
+    meta.update(kw)
+    st.session_state.qa_meta = meta
+
+def _note_api_error(e: Exception):
+    # 重試用盡後改用備援內容，但把原因記下來，草稿區會提示
+    errors = list(st.session_state.get("qa_meta", {}).get("errors", []))
+    errors.append(f"{type(e).__name__}: {e}")
+    _update_qa_meta(errors=errors)
+
+def _pick_question_mode() -> str:
     # 50% 機率：改為用 API 產生「導向介紹圖片」的單句問句（更有變化性）
     # 另一半則維持原本「看圖提出可回答的具體問題」
-    if random.random() < 0.5:
-        mode = "intro"
-        client_alt = _get_client()
-        if client_alt:
+    return "intro" if random.random() < 0.5 else "visual"
+
+async def gen_question_from_image(
+    client,
+    img_path: str,
+    img_url: Awaitable[Optional[str]],
+    temperature: float,
+    mode: Optional[str] = None,
+) -> Optional[str]:
+    # 問題生成的模式與隨機種子（供 UI 顯示；成功或走備援都一樣，只寫一次）
+    mode = mode or _pick_question_mode()
+    q_seed = random.randint(1, 10_000)
+    _update_qa_meta(mode=mode, temperature=temperature, q_seed=q_seed)
+    if mode == "intro":
+        if client:
             try:
                 # 盲問：不傳圖片、不傳文本線索，避免模型提前帶入背景知識
-                sys_alt = (
-                    "你是一位提示語句產生器，目標是產生一個能引導對方『介紹這張圖片或談談由來/故事』的單句問句。"
-                    "限制：使用繁體中文、自然口語、不可包含引號或前後綴字樣、不要超過30字。"
-                    "重點：問題必須通用、開放式，不能包含任何具體地名、數字、人名或推測，不得引用圖片或文字中的內容。"
-                )
-                user_alt = (
-                    "請只輸出一句自然的繁中問句，引導對方介紹或說說這張圖的背景故事。"
-                    "務必避免加入任何特定名詞或細節，讓問句具有普適性。"
-                )
                 alt_messages = [
-                    {"role": "system", "content": sys_alt},
-                    {"role": "user", "content": user_alt},
+                    {"role": "system", "content": _SYS_INTRO_Q},
+                    {"role": "user", "content": _USER_INTRO_Q},
                 ]
-                alt_resp = client_alt.chat.completions.create(
-                    model=MODEL,
-                    messages=alt_messages,
-                    temperature=temperature,
-                    seed=q_seed,
-                )
-                alt_q = (alt_resp.choices[0].message.content or "").strip()
+                # 盲問的輸入與資料無關，快取會讓問句失去變化，所以不走快取
+                alt_q = (await _cached_chat(
+                    client, alt_messages, temperature, q_seed, max_tokens=Q_MAX_TOKENS, use_cache=False
+                )).strip()
                 alt_q = re.sub(r"\s+", " ", alt_q)
                 if alt_q:
-                    # 將元資料存到 session，供 UI 顯示
-                    st.session_state.qa_meta = {
-                        "mode": mode, "temperature": temperature, "q_seed": q_seed
-                    }
                     return alt_q
-            except Exception:
-                pass
+            except Exception as e:
+                _note_api_error(e)
         # API 失敗備援（仍屬於 intro 模式）
-        st.session_state.qa_meta = {"mode": mode, "temperature": temperature, "q_seed": q_seed}
-        return "可以簡單介紹一下這張圖片嗎？"
-    client = _get_client()
+        return _INTRO_QUESTION
     if client and SUPPORTS_VISION:
         try:
-            url = _data_url(img_path)
+            url = await img_url
             if url:
                 messages = [
-                    {"role": "system", "content": "你是精準的視覺助理。請根據圖片提出『一個』具體可答的問題，避免主觀揣測。以繁體中文。"},
+                    {"role": "system", "content": _SYS_VISUAL_Q},
                     {"role": "user", "content": [
                         {"type": "text", "text": "請只輸出問題一句話。"},
                         {"type": "image_url", "image_url": {"url": url}},
                     ]},
                 ]
-                resp = client.chat.completions.create(
-                    model=MODEL,
-                    messages=messages,
-                    temperature=temperature,
-                    seed=q_seed,
-                )
-                q = (resp.choices[0].message.content or "").strip()
+                q = (await _cached_chat(client, messages, temperature, q_seed, max_tokens=Q_MAX_TOKENS)).strip()
                 if q:
-                    st.session_state.qa_meta = {"mode": mode, "temperature": temperature, "q_seed": q_seed}
                     return q
-        except Exception:
-            pass
+        except Exception as e:
+            _note_api_error(e)
 
-    filename = os.path.basename(img_path or "") if img_path else ""
-    first_lines = (fallback_text or "").splitlines()[0:3]
-    hint = " / ".join([h.strip() for h in first_lines if h.strip()])[:200]
-    if not hint:
-        hint = "圖片中的地點、建物或場景"
+    # API 失敗備援：只在這裡才需要檔名
+    filename = os.path.basename(img_path) if img_path else ""
     return f"這張圖所呈現的「{filename or '場景'}」中，最具代表性的元素是什麼？"
 
-def gen_answer_from_text(
+async def gen_answer_from_text(
+    client,
     only_text: str,
     question: str,
     temperature: float,
-    img_path: Optional[str] = None,
+    img_url: Optional[Awaitable[Optional[str]]] = None,
     background_prob: float = 1.0,
+    on_delta: Optional[Callable[[str], None]] = None,
 ) -> Optional[str]:
-    client = _get_client()
     if not client:
         return "文字未提供相關資訊。"
 
     url = None
-    if SUPPORTS_VISION and img_path:
-        try:
-            url = _data_url(img_path)
-        except Exception:
-            url = None
+    if SUPPORTS_VISION and img_url is not None:
+        url = await img_url
 
     add_bg = random.random() < max(0.0, min(1.0, background_prob))
 
-    sys = (
-        "你是一位自然親切、知識穩健的助理。"
-        "請以自然語氣作答，像在與使用者對話，不使用任何標題或固定格式。"
-        "回答時不得提及或暗示資訊來源（例如『從圖片可見』『根據文字內容』『依照提示』等），"
-        "也不要提到系統、規則、模型或任何技術性詞彙。"
-        "先清楚回答問題；若有助理解且允許補充，可自然加入背景脈絡，使用不確定語氣（如『可能、一般來說、或許』），"
-        "避免對特定人事時地物做未經證實的斷言。"
-        "當你要引入新的地名、人物或主題，而這些資訊並未在問題或文字中明確出現時，"
-        "請務必在前面加上自然的承接句，使敘事流暢。"
-        "最後可用一句自然的話詢問對方是否想更深入了解。"
-    )
-
     control_hint = "可適度補充背景" if add_bg else "僅回答問題，不另外補充"
     user_text = (
         f"【風格】自然、清楚、口語且不生硬；避免任何透露來源的語句。\n"
@@ -310,7 +589,7 @@ def gen_answer_from_text(
 
     if url:
         messages = [
-            {"role": "system", "content": sys},
+            {"role": "system", "content": _SYS_ANSWER},
             {"role": "user", "content": [
                 {"type": "text", "text": user_text},
                 {"type": "image_url", "image_url": {"url": url}},
@@ -318,68 +597,355 @@ def gen_answer_from_text(
         ]
     else:
         messages = [
-            {"role": "system", "content": sys},
+            {"role": "system", "content": _SYS_ANSWER},
             {"role": "user", "content": user_text},
         ]
 
     a_seed = random.randint(1, 10_000)
     # 將 a_seed 也寫到 session 的 qa_meta（若已存在就更新）
-    try:
-        meta = dict(st.session_state.get("qa_meta", {}))
-        meta["a_seed"] = a_seed
-        st.session_state.qa_meta = meta
-    except Exception:
-        st.session_state.qa_meta = {"a_seed": a_seed, "temperature": temperature}
+    _update_qa_meta(a_seed=a_seed, temperature=temperature)
 
     try:
-        resp = client.chat.completions.create(
-            model=MODEL,
-            messages=messages,
-            temperature=temperature,
-            seed=a_seed,
-        )
-        out = (resp.choices[0].message.content or "").strip()
+        # 串流時先顯示原文，收完後再整段 sanitize
+        out = (await _cached_chat(
+            client, messages, temperature, a_seed, max_tokens=A_MAX_TOKENS, on_delta=on_delta
+        )).strip()
         return sanitize_model_output(out)
-    except Exception:
+    except Exception as e:
+        _note_api_error(e)
         return "文字未提供相關資訊。"
 
+async def _gen_pair(
+    img_path: str,
+    text: str,
+    temperature: float,
+    on_delta: Optional[Callable[[str], None]] = None,
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    產生一組 Q / A，A 以串流回傳；圖片編碼一律與 Q 的請求並行。
+    - 看圖提問：A 依賴 Q，只能依序呼叫
+    - 導向介紹（盲問）：問句本來就是通用的「介紹這張圖」，A 直接針對它作答，與 Q 並行
+    """
+    st.session_state.qa_meta = {}
+    url_task = asyncio.create_task(_data_url_async(img_path if SUPPORTS_VISION else ""))
+    client = _get_client()
+    mode = _pick_question_mode()
+    try:
+        if mode == "intro":
+            q, a = await asyncio.gather(
+                gen_question_from_image(client, img_path, url_task, temperature, mode=mode),
+                gen_answer_from_text(client, text, _INTRO_QUESTION, temperature, img_url=url_task, on_delta=on_delta),
+            )
+            return (q, a) if q else (None, None)
+        q = await gen_question_from_image(client, img_path, url_task, temperature, mode=mode)
+        if not q:
+            return None, None
+        a = await gen_answer_from_text(client, text, q, temperature, img_url=url_task, on_delta=on_delta)
+        return q, a
+    finally:
+        if client:
+            await client.close()
+
 # ------------------------
 # JSONL I/O
 # ------------------------
 
-def read_jsonl(path: str) -> List[Dict[str, Any]]:
+def _record_id(obj: Any) -> Optional[Any]:
+    """資料的穩定識別碼（頂層 id），沒有則回傳 None。"""
+    rid = obj.get("id") if isinstance(obj, dict) else None
+    return rid if isinstance(rid, (str, int)) else None
+
+_BIG_INT_RE = re.compile(rb"\d{20}")  # orjson 會把超過 64 位元的整數轉成 float，這種行交給標準 json
+
+def _json_loads(ln: bytes) -> Any:
+    if orjson is not None and not _BIG_INT_RE.search(ln):
+        try:
+            return orjson.loads(ln)
+        except orjson.JSONDecodeError:
+            pass  # NaN / Infinity 等標準 json 接受的寫法，改用標準 json，不把這筆當壞行丟掉
+    return json.loads(ln)
+
+def _has_nonfinite(o: Any) -> bool:
+    if isinstance(o, float):
+        return not math.isfinite(o)
+    if isinstance(o, dict):
+        return any(_has_nonfinite(v) for v in o.values())
+    if isinstance(o, list):
+        return any(_has_nonfinite(v) for v in o)
+    return False
+_MMAP_THRESHOLD = 64 << 20  # 超過 64 MB 的 JSONL 走 mmap
+_SIDECAR_FORMAT = 2  # 解析規則改變時遞增，讓舊的 .pkl 失效
+
+def _intern_record(obj: Any):
+    """把大量重複的短字串（role / model / contributor）intern 成同一個物件，降低 data_items 佔用。"""
+    if not isinstance(obj, dict):
+        return
+    for k in ("model", "contributor"):
+        v = obj.get(k)
+        if isinstance(v, str):
+            obj[k] = sys.intern(v)
+    msgs = obj.get("messages")
+    if isinstance(msgs, list):
+        for m in msgs:
+            if isinstance(m, dict) and isinstance(m.get("role"), str):
+                m["role"] = sys.intern(m["role"])
+
+def _parse_jsonl_lines(lines) -> List[Dict[str, Any]]:
+    """
+    逐行（bytes）解析；壞行略過。
+    只有 append_jsonl 寫的變更行（帶 _patch = 目標位置）會逐欄合併進該筆，
+    其餘每行都是獨立的一筆（資料集的 id 不保證唯一）。
+    """
+    out = []
+    for ln in lines:
+        ln = ln.strip()
+        if not ln:
+            continue
+        try:
+            obj = _json_loads(ln)
+        except Exception:
+            continue
+        _intern_record(obj)
+        target = obj.pop("_patch", None) if isinstance(obj, dict) else None
+        if target is not None:
+            # 位置對不上或 id 不符（檔案被其他程式改過）就丟掉這行變更，不套到別筆上
+            if (isinstance(target, int) and 0 <= target < len(out)
+                    and _record_id(out[target]) == _record_id(obj)):
+                out[target].update(obj)
+            continue
+        out.append(obj)
+    return out
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def _read_jsonl_cached(path: str, mtime: float) -> List[Dict[str, Any]]:
+    # mtime 只作為快取鍵：檔案被改寫後自動失效；只留最近兩版，舊版不必常駐記憶體
     if not os.path.exists(path):
         return []
-    out = []
-    with open(path, "r", encoding="utf-8") as f:
-        for ln in f:
-            ln = ln.strip()
-            if not ln:
-                continue
-            try:
-                out.append(json.loads(ln))
-            except Exception:
-                pass
+    # 旁邊的 .pkl 若記錄的 (mtime, size) 與 JSONL 相同就直接 unpickle，
+    # 省掉逐行 json 解析（跨 process 重啟也有效）
+    sidecar = path + ".pkl"
+    st_ = os.stat(path)
+    tag = (_SIDECAR_FORMAT, st_.st_mtime_ns, st_.st_size)
+    try:
+        with open(sidecar, "rb") as f:
+            cached_tag, cached = pickle.load(f)
+        if cached_tag == tag:
+            return cached
+    except Exception:
+        pass
+    out = _parse_jsonl_file(path)
+    try:
+        tmp = f"{sidecar}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump((tag, out), f, protocol=5)
+        os.replace(tmp, sidecar)
+    except OSError:
+        pass
     return out
 
+def _parse_jsonl_file(path: str) -> List[Dict[str, Any]]:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size > _MMAP_THRESHOLD:
+            # 大檔改用 mmap 逐行解析，由 OS page cache 撐著，不在記憶體裡多留一份整檔副本
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return _parse_jsonl_lines(iter(mm.readline, b""))
+        # 一次讀進來再切行，比逐行 iterate 文字檔快；orjson 直接吃 bytes
+        data = f.read()
+    return _parse_jsonl_lines(data.split(b"\n"))
+
+def read_jsonl(path: str) -> List[Dict[str, Any]]:
+    # 以 (path, mtime) 為鍵共用 st.cache_data：各 session 共用一次解析，檔案有變才重解析
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        mtime = 0.0
+    return _read_jsonl_cached(path, mtime)
+
+def _dumps_line(obj: Dict[str, Any]) -> bytes:
+    if orjson is not None:
+        try:
+            line = orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+        except orjson.JSONEncodeError:
+            line = None  # 超過 64 位元的整數
+        # orjson 會把 NaN / Infinity 寫成 null；只有輸出含 null 的行才需要檢查
+        if line is not None and not (b"null" in line and _has_nonfinite(obj)):
+            return line
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8") + b"\n"
+
+@contextmanager
+def _path_lock(path: str):
+    # 同一把 path + ".lock"：Unix 上 filelock 本來也是 flock 這個檔，新舊程式可以互斥
+    if fcntl is None:
+        with FileLock(path + ".lock"):
+            yield
+        return
+    with open(path + ".lock", "a") as lf:
+        fcntl.flock(lf.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lf.fileno(), fcntl.LOCK_UN)
+
 def write_jsonl(path: str, items: List[Dict[str, Any]]):
     os.makedirs(os.path.dirname(os.path.abspath(path)) or ".", exist_ok=True)
-    lock = FileLock(path + ".lock")
+    # 暫存檔名各寫入者獨立，序列化與 fsync 不必持鎖；鎖只包住 replace
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    # 先在記憶體組好整份 payload，一次 write 交給 kernel
+    payload = b"".join(_dumps_line(obj) for obj in items)
+    try:
+        with open(tmp, "wb", buffering=1 << 20) as f:
+            f.write(payload)
+            # 確保資料真的落地後才 replace，當機時不會換上一個寫一半的檔案
+            f.flush()
+            os.fsync(f.fileno())
+        with _path_lock(path):
+            os.replace(tmp, path)
+    except BaseException:
+        # 暫存檔名不會被下次寫入覆蓋，失敗（例如磁碟滿）就自己清掉
+        _unlink_quiet(tmp)
+        raise
+
+def append_jsonl(path: str, obj: Dict[str, Any]):
+    """追加一行到檔尾；讀取時會依 id 把這行的欄位合併進原本那筆。"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)) or ".", exist_ok=True)
+    # 與 write_jsonl 的 replace 互斥，避免追加到即將被換掉的舊檔
+    with _path_lock(path):
+        with open(path, "a+b", buffering=1 << 20) as f:
+            # 手動編輯或匯出的檔案可能沒有結尾換行，直接追加會黏在最後一筆上把兩筆都弄壞
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+            f.write(_dumps_line(obj))
+
+# ------------------------
+# SQLite（設定 DATA_DB 時啟用）：一筆資料一列，存檔只 UPDATE 該列
+# ------------------------
+
+@st.cache_resource(show_spinner=False)
+def _db() -> Tuple[sqlite3.Connection, threading.Lock]:
+    # 整個 process 共用一條連線，跨 session / thread 存取以 lock 串行化
+    con = sqlite3.connect(DATA_DB, isolation_level=None, check_same_thread=False)
+    con.executescript(
+        "PRAGMA journal_mode=WAL;"
+        "PRAGMA synchronous=NORMAL;"
+        "CREATE TABLE IF NOT EXISTS items("
+        "  id INTEGER PRIMARY KEY,"  # = data_items 索引 + 1
+        "  data BLOB NOT NULL,"      # 整筆資料的 JSON
+        "  has_msgs INTEGER NOT NULL DEFAULT 0"
+        ");"
+        "CREATE INDEX IF NOT EXISTS idx_hasmsgs ON items(has_msgs);"
+    )
+    return con, threading.Lock()
+
+def _db_row(idx: int, obj: Dict[str, Any]) -> Tuple[bytes, int, int]:
+    return _dumps_line(obj).rstrip(b"\n"), int(bool(obj.get("messages"))), idx + 1
+
+def read_db() -> List[Dict[str, Any]]:
+    """從 SQLite 讀出全部資料；資料庫為空時先從 DATA（JSONL）匯入。"""
+    con, lock = _db()
     with lock:
-        tmp = path + ".tmp"
-        with open(tmp, "w", encoding="utf-8") as f:
-            for obj in items:
-                f.write(json.dumps(obj, ensure_ascii=False) + "\n")
-        os.replace(tmp, path)
+        rows = con.execute("SELECT data FROM items ORDER BY id").fetchall()
+        if not rows:
+            items = read_jsonl(DATA_JSONL)
+            con.execute("BEGIN")
+            try:
+                con.executemany(
+                    "INSERT INTO items(data, has_msgs, id) VALUES (?, ?, ?)",
+                    (_db_row(i, obj) for i, obj in enumerate(items)),
+                )
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+            return items
+    return _parse_jsonl_lines(r[0] for r in rows)
+
+def update_db(idx: int, obj: Dict[str, Any]):
+    con, lock = _db()
+    with lock:
+        con.execute("UPDATE items SET data = ?, has_msgs = ? WHERE id = ?", _db_row(idx, obj))
+
+# ------------------------
+# 讀寫入口：依設定走 SQLite 或 JSONL
+# ------------------------
+
+def load_items() -> List[Dict[str, Any]]:
+    return read_db() if DATA_DB else read_jsonl(DATA_JSONL)
+
+_APPEND_FIELDS = ("messages", "model", "contributor")  # 新增對話時會變動的欄位
+
+def persist_item(items: List[Dict[str, Any]], idx: int, appended: bool = False):
+    """
+    把 items[idx] 的變更寫回：
+    - SQLite：只更新該列
+    - JSONL：只追加對話且有 id 時，只追加 {_patch, id, messages, model, contributor} 一行；其餘整檔重寫
+    """
+    item = items[idx]
+    if DATA_DB:
+        update_db(idx, item)
+    elif appended and _record_id(item) is not None:
+        # 不重寫 text 等大欄位，只記錄這次會變動的欄位
+        # _patch 記錄目標位置：id 不唯一時也只會合併回這一筆
+        delta = {"_patch": idx}
+        delta.update((k, item[k]) for k in ("id",) + _APPEND_FIELDS if k in item)
+        append_jsonl(DATA_JSONL, delta)
+    else:
+        write_jsonl(DATA_JSONL, items)
 
 # ------------------------
 # Session state
 # ------------------------
 
+@st.cache_resource(show_spinner=False)
+def _loader_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="jsonl-loader")
+
+def _load_data_items(items: Optional[List[Dict[str, Any]]] = None):
+    """載入資料並重算衍生統計；之後由存檔/刪除增量維護，不必每次 rerun 全掃。"""
+    if items is None:
+        items = load_items()
+    st.session_state.data_items = items
+    st.session_state.completed_count = sum(1 for it in items if it.get("messages"))
+    st.session_state.empty_idx = {i for i, it in enumerate(items) if not it.get("messages")}
+    st.session_state.empty_snapshot = None  # 🎲 用的 tuple 快照，empty_idx 有變動才重建
+    contrib = Counter()
+    for it in items:
+        c = (it.get("contributor") or "").strip()  # 每筆只 strip 一次
+        if c:
+            contrib[c] += 1
+    st.session_state.contrib = contrib
+
+def _mark_filled(idx: int):
+    """idx 這筆從沒有對話變成有對話。"""
+    st.session_state.completed_count += 1
+    st.session_state.empty_idx.discard(idx)
+    st.session_state.empty_snapshot = None
+
+def _mark_empty(idx: int):
+    """idx 這筆的對話被刪光。"""
+    st.session_state.completed_count -= 1
+    st.session_state.empty_idx.add(idx)
+    st.session_state.empty_snapshot = None
+
+def _set_contributor(item: Dict[str, Any], name: str):
+    """改寫 item 的 contributor，並同步更新 session 裡的貢獻者統計。"""
+    contrib = st.session_state.contrib
+    old = (item.get("contributor") or "").strip()
+    if old:
+        contrib[old] -= 1
+        if contrib[old] <= 0:
+            del contrib[old]
+    item["contributor"] = sys.intern(name) if name else name
+    new = (name or "").strip()
+    if new:
+        contrib[new] += 1
+
 if "auth_user" not in st.session_state:
     st.session_state.auth_user = None  # {"username":..., "role":...}
-if "data_items" not in st.session_state:
-    st.session_state.data_items = read_jsonl(DATA_JSONL)
+if "data_items" not in st.session_state and "data_future" not in st.session_state:
+    # 首次載入丟到背景 thread，先畫出 sidebar 登入區，用到資料時才等結果
+    st.session_state.data_future = _loader_pool().submit(load_items)
 if "idx" not in st.session_state:
     st.session_state.idx = 0
 if "qa_draft" not in st.session_state:
@@ -394,7 +960,7 @@ if "temperature" not in st.session_state:
 # ------------------------
 
 st.sidebar.header("🔐 登入 Twinkle Gallery")
-users = load_users_from_secrets()
+users = users_by_name()
 
 if st.session_state.auth_user:
     st.sidebar.success(f"已登入：{st.session_state.auth_user['username']}")
@@ -407,7 +973,7 @@ else:
         password = st.text_input("密碼", type="password")
         ok = st.form_submit_button("登入", width='stretch')
     if ok:
-        rec = next((u for u in users if u.get("username") == username), None)
+        rec = users.get(username)
         if rec and verify_password(rec, password):
             st.session_state.auth_user = {"username": rec["username"], "role": rec.get("role", "editor")}
             st.sidebar.success("登入成功！")
@@ -415,10 +981,16 @@ else:
         else:
             st.sidebar.error("登入失敗，請檢查帳密。")
 
+if "data_items" not in st.session_state:
+    # 先拿掉 future：載入失敗時下次 rerun 會重新提交，而不是一直丟出同一個例外
+    data_future = st.session_state.pop("data_future")
+    with st.spinner("載入資料中…"):
+        _load_data_items(data_future.result())
+
 st.sidebar.markdown("---")
 # 進度條（messages 完成比例）
 total = len(st.session_state.data_items)
-completed = sum(1 for it in st.session_state.data_items if it.get("messages"))
+completed = st.session_state.completed_count
 percent = int(round((completed / total) * 100)) if total else 0
 st.sidebar.caption("完成度（有對話的筆數 / 全部）")
 st.sidebar.progress(percent)  # 0~100
@@ -429,16 +1001,13 @@ if st.session_state.auth_user:
     st.sidebar.markdown("---")
     st.sidebar.markdown("#### 👥 貢獻者統計")
 
-    contrib = Counter(
-        (it.get("contributor") or "").strip()
-        for it in st.session_state.data_items
-        if (it.get("contributor") or "").strip()
-    )
+    contrib = st.session_state.contrib
     if contrib:
         total_contrib = sum(contrib.values())
 
         # 以兩欄 metric 呈現 Top N（更像小卡片）
-        top_items = contrib.most_common(6)
+        ranked = contrib.most_common()  # 排序一次，小卡與長條圖共用
+        top_items = ranked[:6]
         cols = st.sidebar.columns(2)
         for idx, (name, cnt) in enumerate(top_items):
             with cols[idx % 2]:
@@ -448,7 +1017,7 @@ if st.session_state.auth_user:
         st.sidebar.caption("分佈概覽")
         # bar_chart 接受 dict/list；這裡用 dict 更簡潔
         st.sidebar.bar_chart(
-            data={k or "(未署名)": v for k, v in contrib.most_common()},
+            data={k or "(未署名)": v for k, v in ranked},
             height=140
         )
     else:
@@ -456,9 +1025,9 @@ if st.session_state.auth_user:
 
 st.sidebar.markdown("---")
 st.sidebar.caption("指導單位")
-moda_img = _pick_image_by_time("static/moda_light.svg", "static/moda_dark.svg")
+moda_img = _pick_image_by_time_cached("static/moda_light.svg", "static/moda_dark.svg")
 st.sidebar.image(moda_img, width='stretch')
-iii_img = _pick_image_by_time("static/iii_light.svg", "static/iii_dark.svg")
+iii_img = _pick_image_by_time_cached("static/iii_light.svg", "static/iii_dark.svg")
 st.sidebar.image(iii_img, width='stretch')
 st.sidebar.image("static/ocf.svg")
 
@@ -478,7 +1047,6 @@ if total == 0:
 item = st.session_state.data_items[st.session_state.idx]
 img_path = item.get("image_path", "")
 text = item.get("text", "")
-messages = item.get("messages", [])
 
 # 兩欄
 left_col, right_col = st.columns(2)
@@ -486,7 +1054,10 @@ left_col, right_col = st.columns(2)
 # ---- 左側：圖片 + 文字 + 🎲 ----
 with left_col:
     if img_path and os.path.exists(img_path):
-        st.image(img_path, width='stretch')
+        try:
+            st.image(_thumbnail(img_path, os.path.getmtime(img_path)), width='stretch')
+        except Exception:
+            st.image(img_path, width='stretch')
         # 圖片 caption：使用 JSONL 的 source（原圖網址）
         src_caption = item.get("source") or ""
         if src_caption:
@@ -494,31 +1065,27 @@ with left_col:
     else:
         st.warning("找不到圖片檔案。")
 
-    st.text_area(
-        "本筆文字",
-        value=text,
-        height=250,
-        key=f"text_display_{st.session_state.idx}",
-        disabled=True,
-        label_visibility="collapsed"
-    )
+    # 唯讀內容用可捲動容器顯示，不必每次 rerun 都同步一個受控 widget
+    with st.container(height=250, border=True):
+        st.text(text)
 
     if st.button("🎲 隨機挑沒有對話的資料", width='stretch'):
-        empty_indices = [i for i, it in enumerate(st.session_state.data_items) if not it.get("messages")]
-        if not empty_indices:
+        if st.session_state.empty_snapshot is None:
+            st.session_state.empty_snapshot = tuple(st.session_state.empty_idx)
+        if not st.session_state.empty_snapshot:
             st.info("沒有 messages 為空的資料。")
         else:
-            st.session_state.idx = random.choice(empty_indices)
+            st.session_state.idx = random.choice(st.session_state.empty_snapshot)
             st.session_state.qa_draft = None
             st.rerun()
 
     # 回報圖文不合：將此筆 contributor 標記為目前登入者
     if st.session_state.auth_user:
         if st.button("🚩 回報圖文不合（將此筆 contributor 設為我）", width='stretch'):
-            item["contributor"] = st.session_state.auth_user["username"]
+            _set_contributor(item, st.session_state.auth_user["username"])
             st.session_state.data_items[st.session_state.idx] = item
             try:
-                write_jsonl(DATA_JSONL, st.session_state.data_items)
+                persist_item(st.session_state.data_items, st.session_state.idx)
                 st.success("已回報並標記貢獻者為你。")
             except Exception as e:
                 st.error(f"回報失敗：{e}")
@@ -526,7 +1093,16 @@ with left_col:
         st.button("🚩 回報圖文不合（需登入）", width='stretch', disabled=True)
 
 # ---- 右側：新增單筆對話（在上方） → 既有對話 ----
-with right_col:
+_RECENT_PAIRS = 6  # 既有對話預設只顯示最近幾筆
+
+@st.fragment
+def _render_conversations():
+    """右側的新增對話與既有對話；存檔/刪除只重跑這一塊，不重跑整頁（資料載入、圖片、sidebar）。"""
+    # fragment 重跑時不會重新執行頂層程式，所以這裡直接從 session 取當前資料
+    item = st.session_state.data_items[st.session_state.idx]
+    img_path = item.get("image_path", "")
+    text = item.get("text", "")
+    messages = item.get("messages", [])
     need_login = st.session_state.auth_user is None
 
     # ✅ (2) 把「新增單筆對話」移到最上面
@@ -538,25 +1114,21 @@ with right_col:
 
     if st.button("➕ 新增單筆對話", width='stretch', disabled=btn_disabled):
         st.session_state.temperature = round(random.uniform(0.1, 0.8), 2)
-        st.sidebar.info(f"🎲 本次隨機溫度：{st.session_state.temperature}")
+        st.info(f"🎲 本次隨機溫度：{st.session_state.temperature}")  # fragment 內不能寫到 sidebar
 
         if not API_KEY or not API_BASE:
             st.error("尚未設定 API（請在 .streamlit/secrets.toml 放入 MY_API_BASE / OPENAI_API_KEY）。")
         else:
-            with st.spinner("VLM 正在看圖提出問題…"):
-                q = gen_question_from_image(img_path, fallback_text=text, temperature=st.session_state.temperature)
+            with st.spinner("VLM 正在看圖提出問題並產生答案…"):
+                answer_preview = st.empty()  # 答案邊收邊顯示，rerun 後由草稿取代
+                q, a = asyncio.run(_gen_pair(
+                    img_path, text, st.session_state.temperature, on_delta=answer_preview.markdown
+                ))
             if not q:
                 st.error("產生問題失敗。")
             else:
-                with st.spinner("根據文字與（如有）圖片產生答案…"):
-                    a = gen_answer_from_text(
-                        text,
-                        q,
-                        temperature=st.session_state.temperature,
-                        img_path=img_path
-                    ) or "文字未提供相關資訊。"
-                st.session_state.qa_draft = {"q": q, "a": a}
-                st.rerun()
+                st.session_state.qa_draft = {"q": q, "a": a or "文字未提供相關資訊。"}
+                st.rerun(scope="fragment")
 
     if st.session_state.qa_draft:
         meta = st.session_state.get("qa_meta", {})
@@ -566,6 +1138,8 @@ with right_col:
         a_seed = meta.get("a_seed", "-")
         # st.info(f"草稿已產生，可編輯後存檔或取消。｜模式：{mode_label}｜temp：{temp_val}｜q_seed：{q_seed}｜a_seed：{a_seed}")
         st.info(f"草稿已產生，可編輯後存檔或取消。｜模式：{mode_label}")
+        for err in meta.get("errors", []):
+            st.warning(f"模型呼叫失敗，已改用備援內容：{err}")
         
         st.text_input("問題（可改）", value=st.session_state.qa_draft["q"], key="draft_q")
         st.text_area("答案（可改）", value=st.session_state.qa_draft["a"], key="draft_a", height=180)
@@ -579,23 +1153,31 @@ with right_col:
                     st.warning("問題與答案不可為空。")
                 else:
                     messages = item.get("messages", [])
+                    had_msgs = bool(messages)
+                    prev_contrib = item.get("contributor")
                     messages.extend([
                         {"role": "user", "content": q},
                         {"role": "assistant", "content": a},
                     ])
                     item["messages"] = messages
+                    if not had_msgs:
+                        _mark_filled(st.session_state.idx)
 
                     if not item.get("model"):
                         item["model"] = MODEL
                     if st.session_state.auth_user:
-                        item["contributor"] = st.session_state.auth_user["username"]
+                        _set_contributor(item, st.session_state.auth_user["username"])
 
                     st.session_state.data_items[st.session_state.idx] = item
                     try:
-                        write_jsonl(DATA_JSONL, st.session_state.data_items)
+                        # 只追加對話、沒有刪改既有欄位
+                        persist_item(st.session_state.data_items, st.session_state.idx, appended=True)
                         st.success("已存檔！")
                         st.session_state.qa_draft = None
-                        st.rerun()
+                        # 完成度或貢獻者有變才需要整頁重跑來更新 sidebar
+                        if not had_msgs or prev_contrib != item.get("contributor"):
+                            st.rerun()
+                        st.rerun(scope="fragment")
                     except Exception as e:
                         st.error(f"存檔失敗：{e}")
 
@@ -603,13 +1185,19 @@ with right_col:
             if st.button("🗑️ 取消本輪新增", type="secondary", width='stretch'):
                 st.session_state.qa_draft = None
                 st.success("已丟棄草稿。")
-                st.rerun()
+                st.rerun(scope="fragment")
 
     st.subheader("既有對話（messages）")
     if not messages:
         st.caption("目前沒有對話。")
     else:
-        for i in range(0, len(messages), 2):
+        starts = list(range(0, len(messages), 2))
+        n_older = max(0, len(starts) - _RECENT_PAIRS)
+        if n_older:
+            # 較早的對話預設不建立輸入框（expander 收起時 widget 仍會建立，所以用 toggle 控制）
+            if not st.toggle(f"顯示較早的 {n_older} 筆對話", key=f"show_older_{st.session_state.idx}"):
+                starts = starts[n_older:]
+        for i in starts:
             pair = messages[i:i+2]
             user_msg = pair[0] if len(pair) > 0 else {}
             asst_msg = pair[1] if len(pair) > 1 else {}
@@ -628,14 +1216,17 @@ with right_col:
                 c_del, c_save = st.columns(2)
                 with c_del:
                     if st.button("🗑️ 刪除", key=f"btn_del_{st.session_state.idx}_{i}", width='stretch', disabled=need_login):
-                        new_msgs = item.get("messages", []).copy()
-                        del new_msgs[i: i+2]
-                        item["messages"] = new_msgs
+                        # messages 就是 item["messages"] 本身，直接就地刪除
+                        del messages[i: i+2]
+                        if not messages:
+                            _mark_empty(st.session_state.idx)
                         st.session_state.data_items[st.session_state.idx] = item
                         try:
-                            write_jsonl(DATA_JSONL, st.session_state.data_items)
+                            persist_item(st.session_state.data_items, st.session_state.idx)
                             st.success("已刪除該筆對話。")
-                            st.rerun()
+                            if not messages:
+                                st.rerun()  # 完成度變了，sidebar 也要更新
+                            st.rerun(scope="fragment")
                         except Exception as e:
                             st.error(f"刪除失敗：{e}")
 
@@ -644,29 +1235,36 @@ with right_col:
                         new_q = st.session_state.get(q_key, "").strip()
                         new_a = st.session_state.get(a_key, "").strip()
                         try:
-                            if i < len(item.get("messages", [])):
-                                item["messages"][i]["content"] = new_q
-                            if i+1 < len(item.get("messages", [])):
-                                item["messages"][i+1]["content"] = new_a
+                            if i < len(messages):
+                                messages[i]["content"] = new_q
+                            if i+1 < len(messages):
+                                messages[i+1]["content"] = new_a
 
                             st.session_state.data_items[st.session_state.idx] = item
-                            write_jsonl(DATA_JSONL, st.session_state.data_items)
+                            persist_item(st.session_state.data_items, st.session_state.idx)
                             st.success("已更新並寫回檔案。")
-                            st.rerun()
+                            st.rerun(scope="fragment")
                         except Exception as e:
                             st.error(f"儲存失敗：{e}")
 
             st.divider()
 
+
+with right_col:
+    _render_conversations()
+    need_login = st.session_state.auth_user is None
+
     st.markdown("---")
     c3, c4 = st.columns(2)
     with c3:
         if st.button("🔄 重新讀取檔案", width='stretch'):
-            st.session_state.data_items = read_jsonl(DATA_JSONL)
+            _read_jsonl_cached.clear()
+            _load_data_items()
             st.success("已重新載入。")
             st.rerun()
     with c4:
         if st.button("🧷 重新寫回（無變更也覆寫）", width='stretch', disabled=need_login):
+            # 使用 SQLite 時，這裡即是匯出成 DATA（JSONL）
             try:
                 write_jsonl(DATA_JSONL, st.session_state.data_items)
                 st.success("已寫回檔案。")